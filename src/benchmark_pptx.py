@@ -0,0 +1,156 @@
+import logging
+import time
+import tracemalloc
+from pathlib import Path
+
+import click
+import mlflow
+from dotenv import load_dotenv
+
+from src.md_to_pptx import (
+    NOTES_POLICIES,
+    notes_sidecar_path_for,
+    render_slides,
+    save_notes_sidecar,
+    save_presentation,
+)
+from src.slide_ir import IR_SUFFIX, load_slides, parse_markdown
+
+# 比較する保存方法 (名前, save_mode, compresslevel)
+SAVE_MODES = [
+    ("default", "default", None),
+    ("fast", "fast", None),
+    ("fast_level1", "fast", 1),
+]
+
+
+def load_ir(input_filepath):
+    """
+    Markdown または IR ファイルから IR を読み込む
+    """
+    if Path(input_filepath).suffix == IR_SUFFIX:
+        return load_slides(input_filepath)
+    return parse_markdown(open(input_filepath, "r").read())
+
+
+def measure(func, repeat=3):
+    """
+    func の実行時間(最小値)とピークメモリを測定する
+    メモリは tracemalloc の影響を受けないよう別に測定する
+    """
+    elapsed = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return min(elapsed), peak
+
+
+def benchmark_save(ir, base_path, output_dir, repeat=3):
+    """
+    保存方法毎に保存時間・ファイルサイズ・ピークメモリを測定する
+    """
+    prs = render_slides(ir, base_path)
+    results = {}
+    for name, save_mode, compresslevel in SAVE_MODES:
+        output_filepath = Path(output_dir) / f"save_{name}.pptx"
+        elapsed, peak = measure(
+            lambda: save_presentation(
+                prs,
+                output_filepath,
+                save_mode=save_mode,
+                compresslevel=compresslevel,
+            ),
+            repeat=repeat,
+        )
+        results[name] = {
+            "seconds": elapsed,
+            "bytes": output_filepath.stat().st_size,
+            "peak_memory_bytes": peak,
+        }
+    return results
+
+
+def benchmark_notes(ir, base_path, output_dir, repeat=3):
+    """
+    ノートの書き方毎に変換時間(作成と保存)とファイルサイズを測定する
+    sidecar はノートのファイルも含める
+    """
+    results = {}
+    for notes_policy in NOTES_POLICIES:
+        output_filepath = Path(output_dir) / f"notes_{notes_policy}.pptx"
+        sidecar_filepath = notes_sidecar_path_for(output_filepath)
+
+        def convert():
+            prs = render_slides(ir, base_path, notes_policy=notes_policy)
+            save_presentation(prs, output_filepath)
+            if notes_policy == "sidecar":
+                save_notes_sidecar(ir, sidecar_filepath)
+
+        elapsed, peak = measure(convert, repeat=repeat)
+        size = output_filepath.stat().st_size
+        if notes_policy == "sidecar":
+            size += sidecar_filepath.stat().st_size
+        results[notes_policy] = {
+            "seconds": elapsed,
+            "bytes": size,
+            "peak_memory_bytes": peak,
+        }
+    return results
+
+
+@click.command()
+@click.argument("input_filepath", type=click.Path(exists=True))
+@click.argument("output_dir", type=click.Path())
+@click.option("--repeat", type=int, default=3)
+def main(**kwargs):
+
+    # init logger
+    logger = logging.getLogger(__name__)
+    logger.info(f"args: {kwargs}")
+    mlflow.set_experiment("benchmark_pptx")
+    mlflow.start_run()
+    mlflow.log_params({f"args.{k}": v for k, v in kwargs.items()})
+
+    # 出力ディレクトリを作成
+    Path(kwargs["output_dir"]).mkdir(parents=True, exist_ok=True)
+
+    # load
+    ir = load_ir(kwargs["input_filepath"])
+    base_path = str(Path(kwargs["input_filepath"]).parent)
+
+    # benchmark
+    benchmarks = {
+        "save": benchmark_save(
+            ir, base_path, kwargs["output_dir"], repeat=kwargs["repeat"]
+        ),
+        "notes": benchmark_notes(
+            ir, base_path, kwargs["output_dir"], repeat=kwargs["repeat"]
+        ),
+    }
+
+    # logging
+    for target, results in benchmarks.items():
+        for name, result in results.items():
+            logger.info(
+                f"{target} {name}: {result['seconds']:.3f}s, "
+                f"{result['bytes']:,} bytes, "
+                f"peak {result['peak_memory_bytes']:,} bytes"
+            )
+            mlflow.log_metrics(
+                {f"{target}.{name}.{k}": v for k, v in result.items()}
+            )
+    mlflow.end_run()
+
+
+if __name__ == "__main__":
+    log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+    load_dotenv()
+    main()
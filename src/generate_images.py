@@ -1,6 +1,6 @@
+import copy
 import io
 import logging
-import re
 import tempfile
 from pathlib import Path
 
@@ -13,6 +13,13 @@ from openai import OpenAI
 from PIL import Image, ImageDraw, ImageFont
 from tqdm import tqdm
 
+from src.slide_ir import (
+    dump_slides,
+    find_image_lines,
+    load_slides,
+    parse_markdown,
+)
+
 
 def log_artifact_from_message(message, filename, mode: str = "w"):
     with tempfile.TemporaryDirectory() as temp_dir:
@@ -87,81 +94,115 @@ def generate_image(
     return images
 
 
-def parse_input_and_generate_image(
+def generate_images_from_slides(
     input_text,
+    ir,
     images_dir: str,
     output_filepath: str,
     model_name: str = "dall-e-3",
     enable_dummy: bool = False,
 ):
     """
-    入力をパースして画像を作成
+    Markdown の画像生成対象の行から画像を作成
+    画像行を置き換え、対応するスライド中間表現(IR)の画像参照を更新して返す
     """
     # init logger
     logger = logging.getLogger(__name__)
 
     # 変数を初期化
-    results = []
     images_dir = Path(images_dir)
-    search_regex = r'!\[(.*)\]\((.*) (".*")\)'
-
-    # 入力を行で分解して各行でループ
     lines = input_text.split("\n")
-    image_count = 0
-    for line in lines:
-        # 正規表現で検索
-        if re.search(search_regex, line):
-            image_count += 0
-
-    with tqdm(total=image_count) as pbar:
-        # 各行をチェック
-        for index, line in enumerate(lines):
-
-            # 正規表現で検索
-            m = re.search(search_regex, line)
-
-            # ヒットした？
-            if m is None:
-                # ヒットしない場合
-                results.append(line)
-                continue
-
-            # ヒットした場合
-            prompt = m.group(1)
-            logger.info(f"{prompt=}")
-
-            # generate
-            if enable_dummy:
-                images = generate_dummy_image(prompt)
-            else:
-                images = generate_image(prompt, model_name=model_name)
-
-            # パスを計算
-            image_filepath = images_dir / f"image_{index}.png"
-            relative_image_path = image_filepath.relative_to(
-                Path(output_filepath).parent
+    ir = copy.deepcopy(ir)
+
+    # 画像生成対象の行は行単位の走査で決め、IR の画像参照は行番号で対応付ける
+    targets = {
+        image["line"]: (slide, image)
+        for slide in ir["slides"]
+        for image in slide["images"]
+        if image["line"] is not None
+    }
+    image_lines = find_image_lines(input_text)
+    for index in sorted(targets.keys() - {x["line"] for x in image_lines}):
+        logger.warning(f"image line {index} not found in markdown, skip")
+
+    # スライドの Markdown に無い行は誤った対応付けなので使わない
+    for index, (slide, _) in list(targets.items()):
+        if index < len(lines) and lines[index].strip() not in slide["source"]:
+            logger.warning(
+                f"image line {index} is not in slide {slide['title']!r}, "
+                "detach"
             )
-            logger.debug(f"{relative_image_path=}")
-
-            # ファイルに出力
-            open(image_filepath, "wb").write(images[0])
-            mlflow.log_artifact(image_filepath)
-            log_artifact_from_message(prompt, f"image_{index}_prompt.txt")
-
-            # 行を編集
-            new_lines = (
-                f"![width:300px bg right:30%]({relative_image_path})"
-                "\n"
-                f"<!-- image_prompt: {prompt} -->"
+            del targets[index]
+
+    for image_line in tqdm(image_lines):
+
+        # 画像生成対象の行番号とプロンプト
+        index = image_line["line"]
+        prompt = image_line["prompt"]
+        logger.info(f"{prompt=}")
+        if index not in targets:
+            logger.warning(
+                f"image line {index} is not attached to any slide: "
+                f"{lines[index]}"
             )
 
-            # 結果に保存
-            results.append(new_lines)
+        # generate
+        if enable_dummy:
+            images = generate_dummy_image(prompt)
+        else:
+            images = generate_image(prompt, model_name=model_name)
+
+        # パスを計算
+        image_filepath = images_dir / f"image_{index}.png"
+        relative_image_path = image_filepath.relative_to(
+            Path(output_filepath).parent
+        )
+        logger.debug(f"{relative_image_path=}")
+
+        # ファイルに出力
+        open(image_filepath, "wb").write(images[0])
+        mlflow.log_artifact(image_filepath)
+        log_artifact_from_message(prompt, f"image_{index}_prompt.txt")
+
+        # 行を編集
+        new_lines = (
+            f"![width:300px bg right:30%]({relative_image_path})"
+            "\n"
+            f"<!-- image_prompt: {prompt} -->"
+        )
+
+        # IR の画像参照とスライドの Markdown を生成済みの画像に更新
+        if index in targets:
+            slide, image = targets[index]
+            slide["source"] = slide["source"].replace(
+                lines[index].strip(), new_lines, 1
+            )
+            image["src"] = str(relative_image_path)
+            image["line"] = None
+        lines[index] = new_lines
 
-            # プログレスバーをアプデート
-            pbar.update(1)
+    return "\n".join(lines), ir
 
-    return "\n".join(results)
+
+def parse_input_and_generate_image(
+    input_text,
+    images_dir: str,
+    output_filepath: str,
+    model_name: str = "dall-e-3",
+    enable_dummy: bool = False,
+):
+    """
+    入力をパースして画像を作成
+    """
+    result, _ = generate_images_from_slides(
+        input_text,
+        parse_markdown(input_text),
+        images_dir=images_dir,
+        output_filepath=output_filepath,
+        model_name=model_name,
+        enable_dummy=enable_dummy,
+    )
+    return result
 
 
 @click.command()
@@ -171,6 +212,8 @@ def parse_input_and_generate_image(
 @click.option("--temperature", type=float, default=0.8)
 @click.option("--model_name", type=str, default="dall-e-3")
 @click.option("--enable_dummy", type=bool, default=False)
+@click.option("--input_slides", type=click.Path(exists=True), default=None)
+@click.option("--output_slides", type=click.Path(), default=None)
 def main(**kwargs):
 
     # init logger
@@ -186,9 +229,16 @@ def main(**kwargs):
     # load input markdown
     input_text = open(kwargs["input_filepath"], "r").read()
 
+    # load slide IR (無ければ Markdown をパース)
+    if kwargs["input_slides"]:
+        ir = load_slides(kwargs["input_slides"])
+    else:
+        ir = parse_markdown(input_text)
+
     # generate
-    result = parse_input_and_generate_image(
+    result, result_ir = generate_images_from_slides(
         input_text,
+        ir,
         model_name=kwargs["model_name"],
         images_dir=kwargs["output_images_dir"],
         output_filepath=kwargs["output_filepath"],
@@ -197,6 +247,8 @@ def main(**kwargs):
 
     # save file
     open(kwargs["output_filepath"], "w").write(result)
+    if kwargs["output_slides"]:
+        dump_slides(result_ir, kwargs["output_slides"])
 
     # logging
     log_artifact_from_message(input_text, "input_text.md")
@@ -1,11 +1,13 @@
+import gzip
+import io
+import json
 import logging
 import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import click
-import markdown
 import mlflow
-from bs4 import BeautifulSoup
 from dotenv import load_dotenv
 from lxml import etree
 from pptx import Presentation
@@ -13,9 +15,18 @@ from pptx.enum.text import PP_ALIGN
 from pptx.oxml.ns import qn
 from pptx.util import Mm, Pt
 
+from src.pptx_package import merge_presentation, save_package
+from src.slide_ir import IR_SUFFIX, load_slides, parse_html, parse_markdown
+
 # office xml open の drawingML namespace
 NSMAP = {"a": "http://schemas.openxmlformats.org/drawingml/2006/main"}
 
+# ノートの書き方
+# none: 書かない / source: スライドの Markdown / truncated: 先頭だけ
+# sidecar: ノートは書かずにスライド番号毎の Markdown を別ファイルに保存
+NOTES_POLICIES = ["none", "source", "truncated", "sidecar"]
+NOTES_MAX_CHARS = 500
+
 
 def log_artifact_from_message(message, filename):
     """
@@ -38,15 +49,18 @@ def get_layout_by_name(prs, query):
 
     # レイアウト名一覧を取得
     names = [x.name for x in prs.slide_layouts]
-    logger.info(f"layout names: {names}")
+    logger.debug("layout names: %s", names)
 
     # レイアウト名を検索(なければ ValueError)
     index = names.index(query)
 
     # レイアウトを取得
     layout = prs.slide_layouts[index]
-    logger.info(f"placeholders: {len(layout.placeholders)}")
-    logger.info(f"placeholders name: {[x.name for x in layout.placeholders]}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("placeholders: %d", len(layout.placeholders))
+        logger.debug(
+            "placeholders name: %s", [x.name for x in layout.placeholders]
+        )
     return layout
 
 
@@ -105,75 +119,121 @@ def configure_presentation(
     )
 
 
+def make_template():
+    """
+    レイアウト調整済みの空のプレゼンテーションをバイナリで返す
+    """
+    prs = Presentation()
+    configure_presentation(prs)
+    buffer = io.BytesIO()
+    prs.save(buffer)
+    return buffer.getvalue()
+
+
 def make_presentation(html, base_path):
+    return render_slides(parse_html(html), base_path)
+
+
+def render_slides(
+    ir,
+    base_path,
+    template=None,
+    notes_policy="truncated",
+    notes_max_chars=NOTES_MAX_CHARS,
+):
+    """
+    スライド中間表現(IR)からプレゼンテーションを作成する
+    template(make_template の結果)を渡すと再利用する
+    """
     # init logger
     logger = logging.getLogger(__name__)
-    prs = Presentation()
-    configure_presentation(prs)
+    if template:
+        prs = Presentation(io.BytesIO(template))
+    else:
+        prs = Presentation()
+        configure_presentation(prs)
 
-    # コンテキストを変数に保持
-    context = {
-        "h1": "",
-        "h2": "",
-        "h3": "",
-    }
+    # ノートの元になるテキストを確認
+    check_notes_source(ir, notes_policy)
 
     # スライド毎にループ
-    for slide_html in html.split("<hr />"):
+    for slide in ir["slides"]:
 
         # デバッグ表示
-        logger.info(f"slide html: {slide_html}")
+        logger.debug("slide: %s > %s", slide["context"], slide["title"])
 
-        # 空のスライドをスキップ
-        if len(slide_html) == 0:
-            continue
+        # スライドを追加
+        if slide["title"]:
+            notes = format_notes(
+                slide["source"], notes_policy, notes_max_chars
+            )
+            add_slide(prs, slide, base_path, notes)
+        else:
+            logger.warning("skip add slide: %.80r", slide["source"])
 
-        # html をパース
-        soup = BeautifulSoup(slide_html, "html.parser")
+    return prs
 
-        # スライドレベルを特定
-        slide_level = None
-        for tag in ["h1", "h2", "h3"]:
-            tag_html = soup.find(tag)
-            if tag_html:
-                slide_level = tag
-                context[tag] = tag_html.get_text()
 
-        # デバッグ表示
-        logger.info(f"{context=}")
+def check_notes_source(ir, notes_policy):
+    """
+    source / sidecar はスライドの Markdown が必要
+    Markdown と HTML を対応付けできなかった場合は ValueError を投げる
+    """
+    if notes_policy not in ("source", "sidecar"):
+        return
+    for index, slide in enumerate(ir["slides"]):
+        if slide["source_type"] != "markdown":
+            raise ValueError(
+                f"notes policy '{notes_policy}' needs slide markdown, "
+                f"but slide {index} has {slide['source_type']} source"
+            )
 
-        # パースしたテキストを保持する変数を作成
-        slide_texts = {"title": "", "context": "", "body": ""}
 
-        # レベルに応じてタイトルとボディを設定
-        if slide_level:
-            title_soup = soup.find(slide_level)
-            slide_texts["title"] = title_soup.get_text()
-            slide_texts["body"] = title_soup.find_next_siblings()
-        else:
-            slide_texts["body"] = [soup]
+def format_notes(source, notes_policy, notes_max_chars=NOTES_MAX_CHARS):
+    """
+    ノートに書くテキストを返す(書かない場合は None)
+    """
+    if notes_policy == "source":
+        return source
+    if notes_policy == "truncated":
+        if len(source) > notes_max_chars:
+            return source[:notes_max_chars] + "…"
+        return source
+    return None
 
-        # パンくずを作成
-        if slide_level == "h1":
-            slide_texts["context"] = ""
-        elif slide_level == "h2":
-            slide_texts["context"] = context["h1"]
-        elif slide_level == "h3":
-            slide_texts["context"] = context["h1"] + " > " + context["h2"]
 
-        # スライドを追加
-        if slide_texts["title"]:
-            add_slide(prs, slide_texts, slide_html, base_path)
-        else:
-            logger.warning(f"skip add slide: {slide_texts}")
+def collect_notes(ir):
+    """
+    スライド番号(1 始まり)毎の Markdown を返す
+    タイトルの無いスライドは作成しないので番号を振らない
+    """
+    check_notes_source(ir, "sidecar")
+    slides = [x for x in ir["slides"] if x["title"]]
+    return {
+        str(number): slide["source"]
+        for number, slide in enumerate(slides, start=1)
+    }
 
-    return prs
 
+def notes_sidecar_path_for(pptx_filepath):
+    """
+    PPTX の隣に置くノートのファイルのパスを返す
+    """
+    return Path(pptx_filepath).with_suffix(".notes.json.gz")
 
-def add_slide(prs, slide_texts, slide_html, base_path: str):
+
+def save_notes_sidecar(ir, filepath):
+    """
+    スライド番号毎の Markdown を gzip 圧縮した JSON で保存する
+    """
+    with gzip.open(filepath, "wt", encoding="utf-8") as f:
+        json.dump(collect_notes(ir), f, ensure_ascii=False)
+
+
+def add_slide(prs, slide_ir, base_path: str, notes=None):
     # init logger
     logger = logging.getLogger(__name__)
-    logger.info(f"{slide_texts=}")
+    logger.debug("blocks: %s", slide_ir["blocks"])
 
     # レイアウトを取得
     layout = get_layout_by_name(prs, "Title and Content")
@@ -183,47 +243,39 @@ def add_slide(prs, slide_texts, slide_html, base_path: str):
 
     # title を設定
     title = slide.shapes.title
-    title.text = slide_texts["title"]
+    title.text = slide_ir["title"]
     title.text_frame.paragraphs[0].font.size = Pt(40)
     title.text_frame.paragraphs[0].alignment = PP_ALIGN.LEFT
 
     # コンテンツを設定
     content = slide.shapes.placeholders[1]  # content
-    draw_soup_to_placeholder(content, slide_texts["body"])
+    draw_blocks_to_placeholder(content, slide_ir["blocks"])
     for x in content.text_frame.paragraphs:
         x.font.size = Pt(30)
 
-    # 画像を追加
-    for tag in slide_texts["body"]:
-        for image_tag in tag.find_all("img"):
-
-            # ファイル名を取得して存在確認
-            image_filepath = Path(base_path) / image_tag.get("src")
-            if image_filepath.exists() is not True:
-                # ファイルが無いと諦める
-                continue
-
-            # picture shape を追加
-            picture = slide.shapes.add_picture(
-                str(image_filepath), Mm(200), Mm(50), Mm(120), Mm(120)
-            )
+    # 画像を追加(タイトルより前の画像は配置しない)
+    for image in slide_ir["images"]:
+        if not image["in_body"]:
+            continue
 
-            # 再背面に配置
-            slide.shapes._spTree.remove(picture._element)
-            slide.shapes._spTree.insert(0, picture._element)
+        # ファイル名を取得して存在確認
+        image_filepath = Path(base_path) / image["src"]
+        if image_filepath.exists() is not True:
+            # ファイルが無いと諦める
+            continue
 
-    # note にデバッグ情報を追加
-    slide.notes_slide.notes_text_frame.text = str(slide_html)
+        # picture shape を追加
+        picture = slide.shapes.add_picture(
+            str(image_filepath), Mm(200), Mm(50), Mm(120), Mm(120)
+        )
 
+        # 再背面に配置
+        slide.shapes._spTree.remove(picture._element)
+        slide.shapes._spTree.insert(0, picture._element)
 
-def parse_li(tag, level=1, ul_ol="ol"):
-    result = []
-    for li_tag in tag.find_all("li", recursive=False):
-        result.append((level, li_tag.get_text(strip=True)))
-        nested = li_tag.find(ul_ol)
-        if nested:
-            result.extend(parse_li(nested, level + 1))
-    return result
+    # note を追加(無い場合はノートスライドを作らない)
+    if notes:
+        slide.notes_slide.notes_text_frame.text = notes
 
 
 def remove_unnumbered_list(pg):
@@ -256,70 +308,173 @@ def replace_bu_to_regular(pg):
     pg._element.pPr.append(bu_auto_num_elem)
 
 
-def draw_soup_to_placeholder(ph, soups):
+def draw_blocks_to_placeholder(ph, blocks):
     # init logger
     logger = logging.getLogger(__name__)
 
-    for soup in soups:
-        logger.info(f"{soup=}")
+    for kind, items in blocks:
+        logger.debug("%s: %s", kind, items)
 
-        if soup.name == "p":
-            # 'p' の場合
-            text = soup.get_text()
-            if len(text) > 0:
-                pg = ph.text_frame.add_paragraph()
-                pg.text = text
-                pg.level = 0
+        for level, text in items:
+            pg = ph.text_frame.add_paragraph()
+            pg.text = text
+            pg.level = level
+            if kind == "p":
+                # 'p' の場合
                 replace_bu_to_regular(pg)
-            for child in soup.children:
-                logger.info(f"{child=}")
-        elif soup.name == "ol":
-            # 'ol' 番号ありリストの場合
-            li_items = parse_li(soup, ul_ol="ol", level=0)
-            logger.info(f"{li_items=}")
-            for level, text in li_items:
-                pg = ph.text_frame.add_paragraph()
-                pg.text = text
-                pg.level = level
+            elif kind == "ol":
+                # 'ol' 番号ありリストの場合
                 replace_to_numbered_list(pg)
 
-        elif soup.name == "ul":
-            # 'ul' 番号なしリストの場合
-            li_items = parse_li(soup, ul_ol="ul", level=0)
-            logger.info(f"{li_items=}")
-            for level, text in li_items:
-                pg = ph.text_frame.add_paragraph()
-                pg.text = text
-                pg.level = level
+
+def convert_markdown_to_pptx(md_text, base_path: str, template=None, **kwargs):
+    return render_slides(
+        parse_markdown(md_text), base_path, template, **kwargs
+    )
 
 
-def convert_markdown_to_pptx(md_text, base_path: str):
-    html = markdown.markdown(md_text)
-    return make_presentation(html, base_path)
+def split_shards(ir, shard_size):
+    """
+    IR のスライド(<hr /> 区切り)を shard_size 枚毎に分割する
+    パンくずはパース時に全体で計算済みなので分割しても変わらない
+    """
+    slides = ir["slides"]
+    starts = range(0, len(slides), shard_size)
+    return [{**ir, "slides": slides[slice(i, i + shard_size)]} for i in starts]
+
+
+def render_shard(ir, base_path, notes_policy, notes_max_chars):
+    """
+    シャードを PPTX にしてバイナリで返す(プロセスプール用)
+    """
+    prs = render_slides(
+        ir,
+        base_path,
+        notes_policy=notes_policy,
+        notes_max_chars=notes_max_chars,
+    )
+    buffer = io.BytesIO()
+    save_package(prs, buffer, compresslevel=1)
+    return buffer.getvalue()
+
+
+def render_sharded(
+    ir,
+    base_path,
+    shard_size,
+    max_workers=None,
+    notes_policy="truncated",
+    notes_max_chars=NOTES_MAX_CHARS,
+):
+    """
+    シャード毎にプロセスプールで PPTX を作成し、パート単位で結合する
+    """
+    # init logger
+    logger = logging.getLogger(__name__)
+
+    shards = split_shards(ir, shard_size)
+    logger.info(f"shards: {len(shards)}")
+    if len(shards) < 2:
+        return render_slides(
+            ir,
+            base_path,
+            notes_policy=notes_policy,
+            notes_max_chars=notes_max_chars,
+        )
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        blobs = executor.map(
+            render_shard,
+            shards,
+            [base_path] * len(shards),
+            [notes_policy] * len(shards),
+            [notes_max_chars] * len(shards),
+        )
+
+        # 先頭のシャードに順に結合
+        prs = Presentation(io.BytesIO(next(blobs)))
+        for blob in blobs:
+            merge_presentation(prs, Presentation(io.BytesIO(blob)))
+
+    return prs
+
+
+def save_presentation(prs, filepath, save_mode="default", compresslevel=None):
+    """
+    プレゼンテーションを保存する
+    fast: 圧縮済みメディアを無圧縮で格納し、パート毎に書き出す
+    """
+    if save_mode == "fast":
+        save_package(prs, filepath, compresslevel=compresslevel)
+    else:
+        prs.save(filepath)
 
 
 @click.command()
 @click.argument("input_filepath", type=click.Path(exists=True))
 @click.argument("output_filepath", type=click.Path())
+@click.option(
+    "--save_mode", type=click.Choice(["default", "fast"]), default="default"
+)
+@click.option("--compresslevel", type=int, default=None)
+@click.option("--shard_size", type=int, default=0)
+@click.option("--max_workers", type=int, default=None)
+@click.option(
+    "--notes_policy", type=click.Choice(NOTES_POLICIES), default="truncated"
+)
+@click.option("--notes_max_chars", type=int, default=NOTES_MAX_CHARS)
 def main(**kwargs):
 
     # init logger
     logger = logging.getLogger(__name__)
     logger.info(f"args: {kwargs}")
+
+    # 圧縮レベルは fast の保存でだけ使う
+    if kwargs["compresslevel"] is not None and kwargs["save_mode"] != "fast":
+        raise click.UsageError("--compresslevel requires --save_mode=fast")
+
     mlflow.set_experiment("make_pptx")
     mlflow.start_run()
     mlflow.log_params({f"args.{k}": v for k, v in kwargs.items()})
 
-    # load prompt
-    md_text = open(kwargs["input_filepath"], "r").read()
+    # load (IR ファイルの場合はパースを省略)
+    base_path = str(Path(kwargs["input_filepath"]).parent)
+    if Path(kwargs["input_filepath"]).suffix == IR_SUFFIX:
+        ir = load_slides(kwargs["input_filepath"])
+    else:
+        ir = parse_markdown(open(kwargs["input_filepath"], "r").read())
+
+    # convert (shard_size を指定した場合は分割して並列に作成)
+    if kwargs["shard_size"] > 0:
+        presentation = render_sharded(
+            ir,
+            base_path,
+            kwargs["shard_size"],
+            max_workers=kwargs["max_workers"],
+            notes_policy=kwargs["notes_policy"],
+            notes_max_chars=kwargs["notes_max_chars"],
+        )
+    else:
+        presentation = render_slides(
+            ir,
+            base_path,
+            notes_policy=kwargs["notes_policy"],
+            notes_max_chars=kwargs["notes_max_chars"],
+        )
 
-    # convert
-    presentation = convert_markdown_to_pptx(
-        md_text, str(Path(kwargs["input_filepath"]).parent)
+    # save file
+    save_presentation(
+        presentation,
+        kwargs["output_filepath"],
+        save_mode=kwargs["save_mode"],
+        compresslevel=kwargs["compresslevel"],
     )
 
-    # save file
-    presentation.save(kwargs["output_filepath"])
+    # ノートを別ファイルに保存
+    if kwargs["notes_policy"] == "sidecar":
+        sidecar_filepath = notes_sidecar_path_for(kwargs["output_filepath"])
+        save_notes_sidecar(ir, sidecar_filepath)
+        mlflow.log_artifact(sidecar_filepath)
 
     # logging
     mlflow.log_artifact(kwargs["output_filepath"])
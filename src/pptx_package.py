@@ -0,0 +1,187 @@
+import zipfile
+
+from lxml import etree
+from pptx.opc.constants import CONTENT_TYPE as CT
+from pptx.opc.constants import RELATIONSHIP_TARGET_MODE as RTM
+from pptx.opc.constants import RELATIONSHIP_TYPE as RT
+from pptx.opc.package import XmlPart, _Relationship
+from pptx.opc.packuri import CONTENT_TYPES_URI, PACKAGE_URI, PackURI
+from pptx.opc.serialized import _ContentTypesItem
+from pptx.parts.image import ImagePart
+
+# 圧縮済みのメディア(再圧縮しても小さくならない)
+STORED_CONTENT_TYPES = {
+    "image/png",
+    "image/jpeg",
+    "image/gif",
+    "image/webp",
+}
+STORED_CONTENT_TYPE_PREFIXES = ("video/", "audio/")
+
+
+def is_stored_content_type(content_type):
+    """
+    無圧縮で格納するパートか判定する
+    """
+    return content_type in STORED_CONTENT_TYPES or content_type.startswith(
+        STORED_CONTENT_TYPE_PREFIXES
+    )
+
+
+def write_xml(zipf, membername, element):
+    """
+    XML を文字列に変換せず、zip のエントリに直接書き込む
+    """
+    with zipf.open(membername, "w") as f:
+        etree.ElementTree(element).write(f, encoding="UTF-8", standalone=True)
+
+
+def save_package(prs, filepath, compresslevel=None):
+    """
+    プレゼンテーションを OPC パッケージとして保存する
+    圧縮済みのメディアは無圧縮で格納し、XML は圧縮して
+    パート毎にファイルへ書き出す
+    """
+    package = prs.part.package
+    parts = tuple(package.iter_parts())
+
+    with zipfile.ZipFile(
+        filepath,
+        "w",
+        compression=zipfile.ZIP_DEFLATED,
+        compresslevel=compresslevel,
+        strict_timestamps=False,
+    ) as zipf:
+
+        # [Content_Types].xml とパッケージの rels
+        write_xml(
+            zipf,
+            CONTENT_TYPES_URI.membername,
+            _ContentTypesItem.xml_for(parts),
+        )
+        zipf.writestr(PACKAGE_URI.rels_uri.membername, package._rels.xml)
+
+        # パート毎に書き込み
+        for part in parts:
+            if isinstance(part, XmlPart):
+                write_xml(zipf, part.partname.membername, part._element)
+            elif is_stored_content_type(part.content_type):
+                zipf.writestr(
+                    part.partname.membername,
+                    part.blob,
+                    compress_type=zipfile.ZIP_STORED,
+                )
+            else:
+                zipf.writestr(part.partname.membername, part.blob)
+
+            # パートの rels
+            if part._rels:
+                zipf.writestr(part.partname.rels_uri.membername, part.rels.xml)
+
+
+def move_part(part, package, partname):
+    """
+    パートを別のパッケージに移し、パート名を付け直す
+    """
+    part.partname = PackURI(partname)
+    part._package = package
+
+
+def retarget(rels, rel, target):
+    """
+    リレーションシップの参照先を付け替える(rId は維持する)
+    参照先はキャッシュされるのでリレーションシップごと作り直す
+    """
+    rels._rels[rel.rId] = _Relationship(
+        rels._base_uri, rel.rId, rel.reltype, RTM.INTERNAL, target
+    )
+
+
+def last_index(parts, base_uri):
+    """
+    base_uri 配下のパート名の最大の連番を返す
+    """
+    return max(
+        (p.partname.idx or 0 for p in parts if p.partname.baseURI == base_uri),
+        default=0,
+    )
+
+
+def merge_presentation(prs, other):
+    """
+    other のスライドを prs の末尾にパート単位で移す
+    スライド・ノート・画像のパート名は連番を付け直し、
+    同じ画像はハッシュで重複を除く
+    ValueError: 未対応のリレーションシップがある場合
+    """
+    package = prs.part.package
+    parts = list(package.iter_parts())
+
+    # 移動先のレイアウトと画像(ハッシュ毎)
+    layouts = {
+        p.partname: p for p in parts if p.content_type == CT.PML_SLIDE_LAYOUT
+    }
+    media = {p.sha1: p for p in parts if isinstance(p, ImagePart)}
+
+    # パート名の連番
+    counters = {
+        "/ppt/slides": last_index(parts, "/ppt/slides"),
+        "/ppt/notesSlides": last_index(parts, "/ppt/notesSlides"),
+        "/ppt/media": last_index(parts, "/ppt/media"),
+    }
+
+    def next_partname(base_uri, name, ext):
+        counters[base_uri] += 1
+        return f"{base_uri}/{name}{counters[base_uri]}.{ext}"
+
+    def merge_image(image_part):
+        # 同じ画像があれば再利用
+        sha1 = image_part.sha1
+        if sha1 not in media:
+            move_part(
+                image_part,
+                package,
+                next_partname("/ppt/media", "image", image_part.partname.ext),
+            )
+            media[sha1] = image_part
+        return media[sha1]
+
+    def merge_notes(notes_part):
+        move_part(
+            notes_part,
+            package,
+            next_partname("/ppt/notesSlides", "notesSlide", "xml"),
+        )
+        for rel in list(notes_part.rels.values()):
+            if rel.reltype == RT.NOTES_MASTER:
+                target = prs.part.notes_master_part
+            else:
+                target = rel.target_part
+            retarget(notes_part.rels, rel, target)
+        return notes_part
+
+    for slide in other.slides:
+        slide_part = slide.part
+        move_part(
+            slide_part, package, next_partname("/ppt/slides", "slide", "xml")
+        )
+
+        # リレーションシップの参照先を付け替え
+        for rel in list(slide_part.rels.values()):
+            if rel.is_external:
+                continue
+            if rel.reltype == RT.SLIDE_LAYOUT:
+                target = layouts[rel.target_part.partname]
+            elif rel.reltype == RT.IMAGE:
+                target = merge_image(rel.target_part)
+            elif rel.reltype == RT.NOTES_SLIDE:
+                target = merge_notes(rel.target_part)
+            else:
+                raise ValueError(f"unsupported relationship: {rel.reltype}")
+            retarget(slide_part.rels, rel, target)
+
+        # スライド一覧に追加
+        rId = prs.part.relate_to(slide_part, RT.SLIDE)
+        prs.slides._sldIdLst.add_sldId(rId)
+
+    return prs
@@ -0,0 +1,379 @@
+import json
+import logging
+import re
+import zlib
+from pathlib import Path
+
+import click
+import markdown
+from bs4 import BeautifulSoup, Comment, Tag
+from dotenv import load_dotenv
+
+# スライド中間表現(IR)ファイルのヘッダ
+IR_MAGIC = b"SLIR"
+IR_VERSION = 4
+
+# IR ファイルの拡張子
+IR_SUFFIX = ".slides"
+
+# 画像生成対象の画像行(タイトル付きの画像)
+IMAGE_REGEX = r'!\[(.*)\]\((.*) (".*")\)'
+
+# 画像生成済みの行に付与されるプロンプトのコメント
+IMAGE_PROMPT_REGEX = r"image_prompt: (.*)"
+
+# スライド区切り(<hr />)になる行
+HR_REGEX = r"^ {0,3}([-*_])( *\1){2,} *$"
+
+# 1 行だけの段落の直後では見出し(setext)の下線になる行
+SETEXT_REGEX = r"^ {0,3}-+ *$"
+
+# ATX 見出しの行(直後から新しいブロックになる)
+HEADING_REGEX = r"^ {0,3}#"
+
+# 見出しにならないブロック(インデントされたコード・HTML)の先頭行
+NOT_SETEXT_REGEX = r"^( {4,}|\t| {0,3}<)"
+
+# 1 行で独立したブロックになる行(インデントされたコード・HTML コメント)
+CODE_REGEX = r"^( {4,}|\t)"
+COMMENT_REGEX = r"^ {0,3}<!--.*--> *$"
+
+
+def slides_path_for(md_filepath):
+    """
+    Markdown ファイルの隣に置く IR ファイルのパスを返す
+    """
+    return Path(md_filepath).with_suffix(IR_SUFFIX)
+
+
+def parse_li(tag, level=1, ul_ol="ol"):
+    result = []
+    for li_tag in tag.find_all("li", recursive=False):
+        result.append((level, li_tag.get_text(strip=True)))
+        nested = li_tag.find(ul_ol)
+        if nested:
+            result.extend(parse_li(nested, level + 1))
+    return result
+
+
+def split_markdown_ranges(md_text):
+    """
+    Markdown を python-markdown が <hr /> にする行で分割し、
+    スライド毎の行範囲 (開始行, 終了行の次) を返す(区切り行は含めない)
+    HTML の <hr /> での分割と対応する
+    `---` はブロックの 1 行目(段落)の直後だけ見出しの下線になる
+
+    >>> split_markdown_ranges("# 1\\n\\n---\\n\\n# 2")
+    [(0, 2), (3, 5)]
+    """
+    lines = md_text.split("\n")
+    ranges = [[0, 0]]
+    block = []
+    for index, line in enumerate(lines):
+        # 見出しの下線(ブロックの 2 行目の `---`)
+        is_setext = (
+            re.match(SETEXT_REGEX, line)
+            and len(block) == 1
+            and not re.match(NOT_SETEXT_REGEX, block[0])
+        )
+
+        # 下線が続く場合はブロック先頭の区切り行も見出しの本文になる
+        next_line = lines[index + 1] if index + 1 < len(lines) else ""
+        is_setext_text = len(block) == 0 and re.match(SETEXT_REGEX, next_line)
+
+        if re.match(HR_REGEX, line) and not (is_setext or is_setext_text):
+            ranges.append([index + 1, index + 1])
+            block = []
+            continue
+
+        # 空行・見出し・HTML コメント・コードの後は新しいブロック
+        ranges[-1][1] = index + 1
+        is_boundary = (
+            len(line.strip()) == 0
+            or is_setext
+            or re.match(HEADING_REGEX, line)
+            or re.match(COMMENT_REGEX, line)
+            or (len(block) == 0 and re.match(CODE_REGEX, line))
+        )
+        if is_boundary:
+            block = []
+        else:
+            block.append(line)
+    return [tuple(x) for x in ranges]
+
+
+def split_markdown(md_text):
+    """
+    Markdown をスライド毎の Markdown に分割する
+
+    >>> md = "---\\nmarp: true\\ntheme: ./style.css\\n---\\n\\n# タイトル"
+    >>> len(split_markdown(md)) == len(markdown.markdown(md).split("<hr />"))
+    True
+    """
+    lines = md_text.split("\n")
+    return [
+        "\n".join(lines[start:end]).strip()
+        for start, end in split_markdown_ranges(md_text)
+    ]
+
+
+def parse_blocks(tags):
+    """
+    タイトル以降のタグを段落・リストのブロックに変換する
+    ブロックは (種類, [(レベル, テキスト), ...]) の形式
+    """
+    blocks = []
+    for tag in tags:
+        if tag.name == "p":
+            # 'p' の場合(空の段落は捨てる)
+            text = tag.get_text()
+            if len(text) > 0:
+                blocks.append(("p", [(0, text)]))
+        elif tag.name in ("ol", "ul"):
+            # 'ol' 番号ありリスト / 'ul' 番号なしリストの場合
+            blocks.append((tag.name, parse_li(tag, ul_ol=tag.name, level=0)))
+    return blocks
+
+
+def find_image_lines(md_text):
+    """
+    Markdown を行単位で走査して画像生成対象の画像の行番号を取得する
+    """
+    image_lines = []
+    for index, line in enumerate(md_text.split("\n")):
+        m = re.search(IMAGE_REGEX, line)
+        if m:
+            image_lines.append(
+                {"line": index, "prompt": m.group(1), "src": m.group(2)}
+            )
+    return image_lines
+
+
+def find_image_prompt(tag):
+    """
+    画像を含むタグの直後にあるプロンプトのコメントを取得する
+    """
+    for sibling in tag.next_siblings:
+        if isinstance(sibling, Comment):
+            m = re.search(IMAGE_PROMPT_REGEX, sibling)
+            return m.group(1).strip() if m else None
+        if isinstance(sibling, Tag):
+            return None
+    return None
+
+
+def top_level_tag(soup, tag):
+    """
+    tag を含む soup 直下のタグを返す
+    """
+    while tag.parent is not soup:
+        tag = tag.parent
+    return tag
+
+
+def parse_images(soup, image_lines, body=None):
+    """
+    スライド内の img タグから画像参照を作成する
+    タイトルより前の画像も含め、body に無い画像は in_body を False にする
+    タイトル付きの画像はスライド内の画像生成対象の行と src で
+    先頭から順に対応付け、行番号とプロンプトは行から取る
+    """
+    images = []
+    for image_tag in soup.find_all("img"):
+        tag = top_level_tag(soup, image_tag)
+        image = {
+            "src": image_tag.get("src"),
+            "prompt": image_tag.get("alt", ""),
+            "line": None,
+            "in_body": body is None or any(tag is x for x in body),
+        }
+
+        # 生成済み画像のプロンプトコメントを取得
+        prompt = find_image_prompt(tag)
+        if prompt:
+            image["prompt"] = prompt
+
+        # 画像生成対象の行を先頭から順に対応付け
+        if image_tag.has_attr("title"):
+            for image_line in image_lines:
+                if image_line["src"] == image["src"]:
+                    image["line"] = image_line["line"]
+                    image["prompt"] = image_line["prompt"]
+                    image_lines.remove(image_line)
+                    break
+
+        images.append(image)
+    return images
+
+
+def parse_html(html, image_lines=None, sources=None, ranges=None):
+    """
+    HTML をスライド単位に分割して IR に変換する
+    sources はスライド毎の Markdown、ranges はその行範囲
+    分割数が合わない場合は各スライドの HTML を source にし、
+    画像生成対象の行はスライドに対応付けない
+    """
+    # init logger
+    logger = logging.getLogger(__name__)
+
+    # コンテキストを変数に保持
+    context = {
+        "h1": "",
+        "h2": "",
+        "h3": "",
+    }
+
+    # スライド毎の Markdown(対応付けできなければ HTML)
+    slide_htmls = html.split("<hr />")
+    source_type = "markdown"
+    if sources is None or len(sources) != len(slide_htmls):
+        logger.warning(
+            "slide markdown does not match html (%s != %d), use html",
+            None if sources is None else len(sources),
+            len(slide_htmls),
+        )
+        sources = [x.strip() for x in slide_htmls]
+        source_type = "html"
+    if ranges is None or len(ranges) != len(slide_htmls):
+        ranges = [(0, 0)] * len(slide_htmls)
+
+    # スライド毎にループ
+    slides = []
+    for slide_html, source, (start, end) in zip(slide_htmls, sources, ranges):
+
+        # 空のスライドをスキップ
+        if len(slide_html) == 0:
+            continue
+
+        # スライドの行範囲にある画像生成対象の行
+        slide_image_lines = [
+            x for x in image_lines or [] if start <= x["line"] < end
+        ]
+
+        # html をパース
+        soup = BeautifulSoup(slide_html, "html.parser")
+
+        # スライドレベルを特定
+        slide_level = None
+        for tag in ["h1", "h2", "h3"]:
+            tag_html = soup.find(tag)
+            if tag_html:
+                slide_level = tag
+                context[tag] = tag_html.get_text()
+
+        # レベルに応じてタイトルとボディを設定
+        slide = {
+            "level": 0,
+            "title": "",
+            "context": "",
+            "blocks": [],
+            "images": [],
+            "source": source,
+            "source_type": source_type,
+        }
+        if slide_level:
+            title_soup = soup.find(slide_level)
+            body = title_soup.find_next_siblings()
+            slide["level"] = int(slide_level[1])
+            slide["title"] = title_soup.get_text()
+            slide["blocks"] = parse_blocks(body)
+            slide["images"] = parse_images(soup, slide_image_lines, body)
+        else:
+            slide["images"] = parse_images(soup, slide_image_lines)
+
+        # img にならなかった行(コード中など)は対応付けない
+        for image_line in slide_image_lines:
+            logger.warning(
+                "image line %d is not attached to slide %r",
+                image_line["line"],
+                slide["title"],
+            )
+
+        # パンくずを作成
+        if slide_level == "h2":
+            slide["context"] = context["h1"]
+        elif slide_level == "h3":
+            slide["context"] = context["h1"] + " > " + context["h2"]
+
+        slides.append(slide)
+
+    logger.info(f"parsed slides: {len(slides)}")
+    return {"version": IR_VERSION, "slides": slides}
+
+
+def parse_markdown(md_text):
+    """
+    Markdown を IR に変換する
+    """
+    html = markdown.markdown(md_text)
+    return parse_html(
+        html,
+        find_image_lines(md_text),
+        split_markdown(md_text),
+        split_markdown_ranges(md_text),
+    )
+
+
+def dumps_slides(ir):
+    """
+    IR をバイナリにシリアライズする
+    """
+    payload = json.dumps(ir, ensure_ascii=False, separators=(",", ":"))
+    return (
+        IR_MAGIC
+        + bytes([IR_VERSION])
+        + zlib.compress(payload.encode("utf-8"), 9)
+    )
+
+
+def loads_slides(data):
+    """
+    バイナリから IR をデシリアライズする
+    形式が異なる場合は ValueError を投げる
+    """
+    if not data.startswith(IR_MAGIC):
+        raise ValueError("not a slide IR file")
+    version = data[len(IR_MAGIC)]
+    if version != IR_VERSION:
+        raise ValueError(f"unsupported slide IR version: {version}")
+    header_size = len(IR_MAGIC) + 1
+    payload = zlib.decompress(data[header_size:])
+    return json.loads(payload.decode("utf-8"))
+
+
+def dump_slides(ir, filepath):
+    open(filepath, "wb").write(dumps_slides(ir))
+
+
+def load_slides(filepath):
+    return loads_slides(open(filepath, "rb").read())
+
+
+@click.command()
+@click.argument("input_filepath", type=click.Path(exists=True))
+@click.argument("output_filepath", type=click.Path(), required=False)
+def main(**kwargs):
+
+    # init logger
+    logger = logging.getLogger(__name__)
+    logger.info(f"args: {kwargs}")
+
+    # 出力先が無ければ Markdown の隣に出力
+    output_filepath = kwargs["output_filepath"] or slides_path_for(
+        kwargs["input_filepath"]
+    )
+
+    # load markdown
+    md_text = open(kwargs["input_filepath"], "r").read()
+
+    # parse and save
+    ir = parse_markdown(md_text)
+    dump_slides(ir, output_filepath)
+    logger.info(f"saved: {output_filepath}")
+
+
+if __name__ == "__main__":
+    log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+    load_dotenv()
+    main()
@@ -0,0 +1,275 @@
+import importlib
+import logging
+import shutil
+import subprocess
+import time
+from pathlib import Path
+
+import click
+from dotenv import load_dotenv
+
+from src import md_to_pptx, slide_ir
+
+# Marp を実行する Docker イメージ
+MARP_IMAGE = "marp-cli-ja"
+
+# コンテナ内の作業ディレクトリ
+MARP_WORKDIR = "/home/marp/app"
+
+
+def snapshot(paths):
+    """
+    監視対象のファイルの更新日時を取得する
+    ディレクトリは配下のファイルを対象にする
+    """
+    result = {}
+    for path in paths:
+        path = Path(path)
+        if path.is_dir():
+            files = [x for x in path.rglob("*") if x.is_file()]
+        elif path.exists():
+            files = [path]
+        else:
+            files = []
+        for file in files:
+            result[str(file)] = file.stat().st_mtime_ns
+    return result
+
+
+def changed_files(before, after):
+    """
+    更新・追加・削除されたファイルを返す
+    """
+    return {
+        path
+        for path in before.keys() | after.keys()
+        if before.get(path) != after.get(path)
+    }
+
+
+def wait_for_changes(paths, before, interval=0.1, debounce=0.3):
+    """
+    変更を検知したら、変更が落ち着くまで待ってからスナップショットを返す
+    """
+    while True:
+        time.sleep(interval)
+        current = snapshot(paths)
+        if current == before:
+            continue
+
+        # debounce: 一定時間変更が無くなるまで待つ
+        while True:
+            time.sleep(debounce)
+            latest = snapshot(paths)
+            if latest == current:
+                return current
+            current = latest
+
+
+def module_files():
+    """
+    PPTX の作成に使うモジュールのファイル
+    """
+    return [str(Path(x.__file__)) for x in (slide_ir, md_to_pptx)]
+
+
+def affected_targets(changed, inputs):
+    """
+    変更されたファイルから再作成が必要な出力を判定する
+    PPTX はスタイルシートを使わないので再作成しない
+    """
+    targets = set()
+    for path in changed:
+        if Path(path).resolve() == Path(inputs["stylesheet"]).resolve():
+            targets.add("html")
+        elif path in module_files():
+            targets.add("pptx")
+        else:
+            # Markdown・画像の変更
+            targets.update(["pptx", "html"])
+    return targets
+
+
+class MarpRenderer:
+    """
+    起動したままの Marp コンテナで HTML を作成する
+    コンテナ起動のコストを変更毎に払わないようにする
+    """
+
+    def __init__(self, build_dir):
+        self.build_dir = Path(build_dir).resolve()
+        self.build_dir.mkdir(parents=True, exist_ok=True)
+        self.container_id = subprocess.run(
+            [
+                "docker",
+                "run",
+                "-d",
+                "--rm",
+                "-v",
+                f"{self.build_dir}:{MARP_WORKDIR}",
+                "--entrypoint",
+                "tail",
+                MARP_IMAGE,
+                "-f",
+                "/dev/null",
+            ],
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+
+    def render(self, md_filepath, stylesheet, images_dir, output_filepath):
+        # 入力をビルドディレクトリにコピー
+        shutil.copy(stylesheet, self.build_dir / "style.css")
+        shutil.copy(md_filepath, self.build_dir / "temp.md")
+        if images_dir and Path(images_dir).exists():
+            shutil.copytree(
+                images_dir,
+                self.build_dir / Path(images_dir).name,
+                dirs_exist_ok=True,
+            )
+
+        # 起動済みのコンテナで変換
+        subprocess.run(
+            [
+                "docker",
+                "exec",
+                "-w",
+                MARP_WORKDIR,
+                self.container_id,
+                "marp",
+                "temp.md",
+                "-o",
+                "temp.html",
+                "--html",
+                "--theme",
+                "style.css",
+                "--allow-local-files",
+            ],
+            check=True,
+            capture_output=True,
+        )
+        shutil.copy(self.build_dir / "temp.html", output_filepath)
+
+    def close(self):
+        subprocess.run(
+            ["docker", "stop", self.container_id], capture_output=True
+        )
+
+
+def format_elapsed(elapsed):
+    return ", ".join(f"{k}: {v:.3f}s" for k, v in elapsed.items())
+
+
+def build(targets, inputs, state):
+    """
+    指定された出力を再作成して、出力毎の所要時間を返す
+    """
+    # init logger
+    logger = logging.getLogger(__name__)
+
+    elapsed = {}
+    if "pptx" in targets:
+        start = time.perf_counter()
+        md_text = open(inputs["input_filepath"], "r").read()
+        presentation = md_to_pptx.convert_markdown_to_pptx(
+            md_text,
+            str(Path(inputs["input_filepath"]).parent),
+            template=state["template"],
+        )
+        presentation.save(inputs["output_filepath"])
+        elapsed["pptx"] = time.perf_counter() - start
+
+    if "html" in targets and state["renderer"]:
+        start = time.perf_counter()
+        try:
+            state["renderer"].render(
+                inputs["input_filepath"],
+                inputs["stylesheet"],
+                inputs["images_dir"],
+                inputs["output_html"],
+            )
+        except subprocess.CalledProcessError as e:
+            logger.error(f"marp failed: {e.stderr}")
+        elapsed["html"] = time.perf_counter() - start
+
+    return elapsed
+
+
+@click.command()
+@click.argument("input_filepath", type=click.Path(exists=True))
+@click.argument("output_filepath", type=click.Path())
+@click.option("--images_dir", type=click.Path(), default=None)
+@click.option("--stylesheet", type=click.Path(), default="src/style.css")
+@click.option("--output_html", type=click.Path(), default=None)
+@click.option("--build_dir", type=click.Path(), default="build/watch")
+@click.option("--interval", type=float, default=0.1)
+@click.option("--debounce", type=float, default=0.3)
+def main(**kwargs):
+
+    # init logger
+    logger = logging.getLogger(__name__)
+    logger.info(f"args: {kwargs}")
+
+    # 監視対象
+    watch_paths = [
+        kwargs["input_filepath"],
+        kwargs["stylesheet"],
+        *module_files(),
+    ]
+    if kwargs["images_dir"]:
+        watch_paths.append(kwargs["images_dir"])
+
+    # 出力ディレクトリを作成
+    Path(kwargs["output_filepath"]).parent.mkdir(parents=True, exist_ok=True)
+
+    # テンプレートをキャッシュし、Marp は起動したままにする
+    state = {
+        "template": md_to_pptx.make_template(),
+        "renderer": None,
+    }
+    if kwargs["output_html"]:
+        state["renderer"] = MarpRenderer(kwargs["build_dir"])
+
+    try:
+        # 初回は全て作成
+        before = snapshot(watch_paths)
+        elapsed = build({"pptx", "html"}, kwargs, state)
+        logger.info(f"initial build {format_elapsed(elapsed)}")
+
+        while True:
+            after = wait_for_changes(
+                watch_paths,
+                before,
+                interval=kwargs["interval"],
+                debounce=kwargs["debounce"],
+            )
+            changed = changed_files(before, after)
+            before = after
+            logger.info(f"changed: {sorted(changed)}")
+
+            # 影響のある出力だけ再作成してレイテンシを表示
+            targets = affected_targets(changed, kwargs)
+            try:
+                # モジュールの変更は読み直してテンプレートも作り直す
+                if changed & set(module_files()):
+                    importlib.reload(slide_ir)
+                    importlib.reload(md_to_pptx)
+                    state["template"] = md_to_pptx.make_template()
+                elapsed = build(targets, kwargs, state)
+            except Exception:
+                logger.exception("rebuild failed")
+                continue
+            logger.info(f"rebuilt {format_elapsed(elapsed)}")
+    except KeyboardInterrupt:
+        logger.info("stop watching")
+    finally:
+        if state["renderer"]:
+            state["renderer"].close()
+
+
+if __name__ == "__main__":
+    log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+    load_dotenv()
+    main()